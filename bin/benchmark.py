@@ -16,7 +16,7 @@ def main():
     print("Cached rendering:   {time}".format(time=benchmark(render_cached)))
     # Test the uncached rendering.
     def render_uncached():
-        loader._cache.clear()
+        loader.clear_cache()
         loader.render("index.html", list_items = list(range(100)))
     print("Uncached rendering: {time}".format(time=benchmark(render_uncached)))
     
@@ -6,17 +6,16 @@ Fast and powerful. It gets the job done.
 Developed by Dave Hall <dave@etianen.com>.
 """
 
+import os
+
 from moody.errors import TemplateError, TemplateCompileError, TemplateRenderError
-from moody.macros import DEFAULT_MACROS
-from moody.parser import Parser
+from moody.parser import Parser, default_parser
 from moody.loader import Loader, DebugLoader, Source, DirectorySource, TemplateDoesNotExist
 
 
 __all__ = ("default_parser", "compile", "render", "make_loader",)
 
 
-default_parser = Parser(DEFAULT_MACROS)
-
 compile = default_parser.compile
 
 
@@ -33,11 +32,17 @@ def make_loader(*sources, loader_cls=Loader, parser=default_parser, **kwargs):
     """Factory method for creating loaders."""
     # Create the sources.
     source_objs = []
+    dirnames = set()
     for source in sources:
         if isinstance(source, Source):
             source_objs.append(source)
         elif isinstance(source, str):
-            source_objs.append(DirectorySource(source))
+            # Skip repeated directories, and paths that are really files, such as zipped eggs on sys.path.
+            dirname = os.path.normpath(source)
+            if dirname in dirnames or os.path.isfile(dirname):
+                continue
+            dirnames.add(dirname)
+            source_objs.append(DirectorySource(dirname))
         else:
             raise TypeError("A source should be a str or a Source instance, not {!r}.".format(source))
     # Instantiate the loader.
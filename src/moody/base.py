@@ -1,7 +1,11 @@
 """Base classes used by the template engine."""
 
 
-import re
+import re, sys, ast, builtins
+from functools import lru_cache
+from keyword import iskeyword
+from operator import attrgetter
+from types import FunctionType
 
 from moody.errors import TemplateRenderError
     
@@ -39,103 +43,252 @@ class Context:
 RE_NAME = re.compile("^[a-zA-Z_][a-zA-Z_0-9]*$")
 
 
+def parse_name(name):
+    """Validates and interns a single variable name."""
+    if not RE_NAME.match(name):
+        raise ValueError("{!r} is not a valid variable name. Only letters, numbers and undescores are allowed.".format(name))
+    return sys.intern(name)
+
+
 def name_setter(name):
     """
     Returns a function that will assign a value to a name in a given context.
     
     The returned function has a signature of set_name(context, value).
     """
-    # Parse the names.
-    if "," in name:
-        names = [name.strip() for name in name.split(",")]
-        if not names[-1]:
-            names.pop()
-        def setter(context, value):
-            # Handle variable expansion.
-            value = iter(value)
-            for name_part in names:
-                try:
-                    context.params[name_part] = next(value)
-                except StopIteration:
-                    raise ValueError("Not enough values to unpack.")
-            # Make sure there are no more values.
-            try:
-                next(value)
-            except StopIteration:
-                pass
-            else:
-                raise ValueError("Need more than {} values to unpack.".format(len(names)))
-    else:
-        names = (name,)
+    # Handle the common case of a single name.
+    if "," not in name:
+        name = parse_name(name)
         def setter(context, value):
             context.params[name] = value
-    # Make sure that the names are valid.
-    for name in names:
-        if not RE_NAME.match(name):
-            raise ValueError("{!r} is not a valid variable name. Only letters, numbers and undescores are allowed.".format(name))
-    # Return the setter.
-    return setter
+        return setter
+    # Parse the expanded names.
+    names = [name.strip() for name in name.split(",")]
+    if not names[-1]:
+        names.pop()
+    names = [parse_name(name) for name in names]
+    # Generate a setter that uses native sequence unpacking, e.g. params['a'], params['b'], = value.
+    targets = "".join("params[{!r}], ".format(name) for name in names)
+    namespace = {}
+    exec("def setter(context, value):\n    params = context.params\n    {}= value".format(targets), namespace)
+    return namespace["setter"]
         
         
+RE_ATTRIBUTE_PATH = re.compile("^[a-zA-Z_][a-zA-Z_0-9]*(?:\\.[a-zA-Z_][a-zA-Z_0-9]*)+$")
+
+
+# Literal types that are safe to share between renders.
+CONSTANT_TYPES = (str, bytes, int, float, complex, type(None),)
+
+
+# The AST nodes for a single literal constant.
+if sys.version_info >= (3, 8):
+    CONSTANT_NODES = (ast.Constant,)
+else:
+    CONSTANT_NODES = tuple(getattr(ast, name) for name in ("Num", "Str", "Bytes", "NameConstant") if hasattr(ast, name))
+
+
+@lru_cache(maxsize=4096)
 def expression_evaluator(expression):
-    expression = compile(expression, "<string>", "eval")
+    """
+    Returns a function that will evaluate an expression in a given context.
+    
+    The returned function has a signature of evaluate(context). Evaluators
+    are stateless, so are shared between all uses of the same expression.
+    """
+    code = compile(expression, "<string>", "eval")
+    # Immutable literals, such as the template name in {% include "foo.html" %}, are evaluated just once.
+    node = ast.parse(expression, mode="eval").body
+    if isinstance(node, CONSTANT_NODES):
+        value = ast.literal_eval(node)
+        if isinstance(value, CONSTANT_TYPES):
+            def evaluator(context):
+                return value
+            return evaluator
+    # Plain variable names are looked up directly, only falling back to eval for meta and builtins.
+    if RE_NAME.match(expression) and not iskeyword(expression):
+        name = sys.intern(expression)
+        def evaluator(context):
+            try:
+                return context.params[name]
+            except KeyError:
+                return eval(code, context.meta, context.params)
+        return evaluator
+    # Dotted attribute paths, such as item.name, skip eval as long as the root name is a param.
+    if RE_ATTRIBUTE_PATH.match(expression) and not any(iskeyword(part) for part in expression.split(".")):
+        name, path = expression.split(".", 1)
+        name = sys.intern(name)
+        get_path = attrgetter(path)
+        def evaluator(context):
+            try:
+                value = context.params[name]
+            except KeyError:
+                return eval(code, context.meta, context.params)
+            return get_path(value)
+        return evaluator
     def evaluator(context):
-        return eval(expression, context.meta, context.params)
+        return eval(code, context.meta, context.params)
     return evaluator
 
 
+class ExpressionNode:
+
+    """A node that writes the value of an expression to the buffer, applying any autoescaping."""
+
+    __slots__ = ("evaluate", "autoescape",)
+
+    def __init__(self, evaluate, autoescape=None):
+        """Initializes the ExpressionNode."""
+        self.evaluate = evaluate
+        self.autoescape = autoescape
+
+
+# The kinds of node that can appear in a render function.
+STRING_NODE = "string"
+EXPRESSION_NODE = "expression"
+ESCAPED_EXPRESSION_NODE = "escaped_expression"
+CALLABLE_NODE = "callable"
+
+
+@lru_cache(maxsize=1024)
+def renderer_code(shape):
+    """
+    Generates the code for a render function that runs the given shape of nodes.
+    
+    The shape is a tuple containing the kind of each node. Node values are
+    looked up from the function globals as value_N, evaluate_N, autoescape_N
+    and node_N, so the same code can be shared between fragments.
+    
+    Returns a tuple of (code, offset), where offset is the line number of the
+    first node in the generated code.
+    """
+    lines = [
+        "def render(context):",
+        "    append = context.buffer.append",
+    ]
+    # Static strings cannot fail, so the error handler is only needed around the other nodes.
+    guarded = any(kind != STRING_NODE for kind in shape)
+    if guarded:
+        lines.append("    try:")
+    indent = "        " if guarded else "    "
+    offset = len(lines) + 1
+    for index, kind in enumerate(shape):
+        if kind == STRING_NODE:
+            lines.append("{}append(value_{})".format(indent, index))
+        elif kind == EXPRESSION_NODE:
+            lines.append("{}append(str(evaluate_{}(context)))".format(indent, index))
+        elif kind == ESCAPED_EXPRESSION_NODE:
+            lines.append("{0}append(autoescape_{1}(str(evaluate_{1}(context))))".format(indent, index))
+        else:
+            lines.append("{}node_{}(context)".format(indent, index))
+    if not shape:
+        lines.append("    pass")
+    if guarded:
+        lines.extend((
+            "    except TemplateRenderError:",
+            "        raise",
+            "    except Exception as ex:",
+            "        raise TemplateRenderError(str(ex), name, linenos[ex.__traceback__.tb_lineno]) from ex",
+        ))
+    namespace = {}
+    exec(compile("\n".join(lines), "<string>", "exec"), namespace)
+    return namespace["render"].__code__, offset
+
+
+def nodes_renderer(nodes, name):
+    """
+    Compiles a list of (lineno, node) pairs into a single render function.
+    
+    Each node is either a static string or an ExpressionNode, which are written
+    straight to the buffer, or a callable with a signature of node(context).
+    The returned function has a signature of render(context), and reports any
+    errors as a TemplateRenderError against the line number of the failing node.
+    """
+    # Functions built from a bare globals dict only see the builtins if they are given explicitly.
+    namespace = {
+        "__builtins__": builtins,
+        "TemplateRenderError": TemplateRenderError,
+        "name": name,
+    }
+    shape = []
+    node_linenos = []
+    for index, (lineno, node) in enumerate(nodes):
+        if isinstance(node, str):
+            namespace["value_{}".format(index)] = node
+            shape.append(STRING_NODE)
+        elif isinstance(node, ExpressionNode):
+            namespace["evaluate_{}".format(index)] = node.evaluate
+            # The autoescape function is fixed when the template is compiled, so is baked into the shape.
+            if node.autoescape:
+                namespace["autoescape_{}".format(index)] = node.autoescape
+                shape.append(ESCAPED_EXPRESSION_NODE)
+            else:
+                shape.append(EXPRESSION_NODE)
+        else:
+            namespace["node_{}".format(index)] = node
+            shape.append(CALLABLE_NODE)
+        node_linenos.append(lineno)
+    code, offset = renderer_code(tuple(shape))
+    # Map the lines of the generated code back onto template line numbers.
+    namespace["linenos"] = [None] * offset + node_linenos
+    return FunctionType(code, namespace)
+
+
 class TemplateFragment:
 
     """A fragment of a template."""
 
-    __slots__ = ("_nodes", "_name",)
+    __slots__ = ("_render_to_context", "_name",)
 
     def __init__(self, nodes, name):
         """Initializes the TemplateFragment."""
-        self._nodes = nodes
+        self._render_to_context = nodes_renderer(nodes, name)
         self._name = name
-    
-    def _render_to_context(self, context):
-        """Renders the template to the given context."""
-        for lineno, node in self._nodes:
-            try:
-                node(context)
-            except TemplateRenderError:
-                raise
-            except Exception as ex:
-                raise TemplateRenderError(str(ex), self._name, lineno) from ex
 
 
 class Template(TemplateFragment):
 
     """A compiled template."""
 
-    __slots__ = ("_params", "_meta",)
+    __slots__ = ("_params", "_meta", "_static_output",)
 
     def __init__(self, nodes, name, params, meta):
         """Initializes the template."""
         super(Template, self).__init__(nodes, name)
         self._params = params
         self._meta = meta
+        # Templates without any tags always render the same string.
+        if all(isinstance(node, str) for lineno, node in nodes):
+            self._static_output = "".join(node for lineno, node in nodes)
+        else:
+            self._static_output = None
 
     def _render_to_sub_context(self, context, meta):
         """Renders the template to the given context."""
-        # Generate the params.
-        sub_params = self._params.copy()
-        sub_params.update(context.params)
+        # Generate the params, letting the context override the defaults.
+        if self._params:
+            sub_params = self._params.copy()
+            sub_params.update(context.params)
+        else:
+            sub_params = context.params.copy()
         # Generate the meta.
-        sub_meta = self._meta.copy()
+        sub_meta = context.meta.copy()
+        sub_meta.update(self._meta)
         sub_meta.update(meta)
         # Generate the sub context.
-        self._render_to_context(context.sub_context(sub_params, sub_meta))
+        self._render_to_context(Context(sub_params, sub_meta, context.buffer))
 
     def render(self, **params):
         """Renders the template, returning the string result."""
-        # Create the params.
-        context_params = self._params.copy()
-        context_params.update(params)
-        # Create the context.
+        if self._static_output is not None:
+            return self._static_output
+        # Create the params. The keyword arguments are a fresh dict, so can be used directly.
+        if self._params:
+            context_params = self._params.copy()
+            context_params.update(params)
+        else:
+            context_params = params
+        # Render the template into a plain list buffer, joining once at the end.
         context = Context(context_params, self._meta, [])
-        # Render the template.
         self._render_to_context(context)
         return context.read()
\ No newline at end of file
@@ -1,8 +1,13 @@
 """A caching template loader that allows disk-based templates to be used."""
 
 
-import os, sys
+import os
+from codecs import BOM_UTF8
+from locale import getpreferredencoding
+from stat import S_ISREG
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
 
 
 class TemplateDoesNotExist(Exception):
@@ -48,7 +53,7 @@ class DirectorySource(Source):
     
     """A template loader that loads from a directory on disk."""
     
-    __slots__ = ("dirname")
+    __slots__ = ("dirname",)
     
     def __init__(self, dirname):
         """
@@ -56,15 +61,42 @@ class DirectorySource(Source):
         
         On windows, the dirname should be specified using forward-slashes.
         """
-        self.dirname = dirname
+        self.dirname = os.path.normpath(dirname)
         
     def load_source(self, template_name):
         """Loads the source from disk."""
         template_path = os.path.normpath(os.path.join(self.dirname, template_name))
-        if os.path.exists(template_path):
-            with open(template_path, "r") as template_file:
-                return template_file.read()
-        return None
+        # Just try to open the file, rather than paying for a separate stat call.
+        try:
+            # O_BINARY stops Windows translating line endings or stopping at Ctrl-Z.
+            fd = os.open(template_path, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+        except OSError:
+            # Any path that cannot be opened is treated as missing, just like os.path.exists() does.
+            return None
+        # Read the raw bytes directly, bypassing the buffered text IO machinery.
+        try:
+            try:
+                file_stat = os.fstat(fd)
+            except OSError:
+                return None
+            if not S_ISREG(file_stat.st_mode):
+                return None
+            # Read the expected size in one call, then carry on to the end in case the file grew.
+            chunks = [os.read(fd, max(file_stat.st_size, 1))]
+            while chunks[-1]:
+                chunks.append(os.read(fd, 65536))
+            data = b"".join(chunks)
+        finally:
+            os.close(fd)
+        # Decode and normalize the source once, at load time, just as text mode would.
+        if data.startswith(BOM_UTF8):
+            # A byte order mark means the file is UTF-8, whatever the locale.
+            template_src = data[len(BOM_UTF8):].decode("utf-8")
+        else:
+            template_src = data.decode(getpreferredencoding(False))
+        if "\r" in template_src:
+            template_src = template_src.replace("\r\n", "\n").replace("\r", "\n")
+        return template_src
         
     def __str__(self):
         """Returns a string representation."""
@@ -98,18 +130,21 @@ class DebugLoader:
         default_meta.update(meta or {})
         return self._parser.compile(template, name, params, default_meta)
     
-    def _load_all(self, template_name):
-        """Loads and returns all the named templates from the sources."""
+    def _compile_source(self, template_src, template_name, super_template):
+        """Compiles the source of the named template, inheriting from the given super template."""
+        return self.compile(template_src, template_name, {}, {"__super__": super_template})
+    
+    def _compile_all(self, template_name):
+        """Loads and compiles all the named templates from the sources."""
         # Load from all the template sources.
         templates = []
         for source in self._sources:
             template_src = source.load_source(template_name)
             if template_src is not None:
-                meta = {
-                    "__super__": templates and templates[-1] or None,
-                }
-                templates.append(self.compile(template_src, template_name, {}, meta))
+                templates.append(self._compile_source(template_src, template_name, templates and templates[-1] or None))
         return templates
+        
+    _load_all = _compile_all
     
     def load(self, *template_names):        
         """
@@ -146,24 +181,58 @@ class Loader(DebugLoader):
     """
     A template loader.
     
-    Compiled templates are cached for performance.
+    Compiled templates are cached for performance. The cache holds at most
+    cache_size template names, discarding the least recently used first. A
+    cache_size of None allows the cache to grow without limit.
+    
+    Compiled templates are also remembered by their source code, so clearing
+    the cache with keep_compiled=True only recompiles the templates that have
+    actually changed.
     """
     
-    __slots__ = ("_cache",)
+    __slots__ = ("_cache", "_cache_size", "_compile_cache",)
     
-    def __init__(self, sources, parser):
+    def __init__(self, sources, parser, cache_size=1024):
         """Initializes the loader."""
         super(Loader, self).__init__(sources, parser)
-        self._cache = {}
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._compile_cache = lru_cache(maxsize=cache_size)(super(Loader, self)._compile_source)
     
-    def clear_cache(self, ):
-        """Clears the template cache."""
+    def clear_cache(self, keep_compiled=False):
+        """
+        Clears the template cache.
+        
+        All compiled templates are released, unless keep_compiled is True, in
+        which case templates whose source has not changed are still reused.
+        """
         self._cache.clear()
+        if not keep_compiled:
+            self._compile_cache.cache_clear()
+    
+    def _compile_source(self, template_src, template_name, super_template):
+        """A caching version of the debug loader's _compile_source method."""
+        return self._compile_cache(template_src, template_name, super_template)
         
     def _load_all(self, template_name):
         """A caching version of the debug loader's load method."""
-        if template_name in self._cache:
-            return self._cache[template_name]
-        template = super(Loader, self)._load_all(template_name)
-        self._cache[template_name] = template
-        return template
\ No newline at end of file
+        cache = self._cache
+        try:
+            templates = cache[template_name]
+        except KeyError:
+            pass
+        else:
+            # Another thread may have evicted the template since it was read, which is fine.
+            try:
+                cache.move_to_end(template_name)
+            except KeyError:
+                pass
+            return templates
+        templates = self._compile_all(template_name)
+        cache[template_name] = templates
+        if self._cache_size is not None and len(cache) > self._cache_size:
+            try:
+                cache.popitem(last=False)
+            except KeyError:
+                pass
+        return templates
\ No newline at end of file
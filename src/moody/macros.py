@@ -1,70 +1,130 @@
 """The default built-in macros."""
 
-import re
-from functools import partial
+import re, ast
+from functools import lru_cache
+from importlib import import_module
 
-from moody.base import expression_evaluator, name_setter, Template
+from moody.base import expression_evaluator, parse_name, name_setter, Template
+
+
+RE_MACRO_KEYWORD = re.compile(r"^\^([a-zA-Z_]+)(?![?*+{])")
 
 
 def regex_macro(regex):
     """A decorator that defines a macro function."""
+    # Patterns that start with a literal keyword can reject most tokens without running the regex.
+    keyword_match = "|" not in regex and RE_MACRO_KEYWORD.match(regex)
+    keyword = keyword_match.group(1) if keyword_match else ""
+    # A keyword that must be followed by whitespace or the end of the tag is the whole first word of the tag.
+    tag_keyword = keyword_match and regex[keyword_match.end():].startswith(("\\s", "$")) and keyword or None
     regex = re.compile(regex, re.DOTALL)
     def decorator(func):
         def wrapper(parser, token):
-            match = regex.match(token)
-            if match:
-                return func(parser, *match.groups(), **match.groupdict())
+            if token.startswith(keyword):
+                match = regex.match(token)
+                if match:
+                    return func(parser, *match.groups(), **match.groupdict())
             return None
+        wrapper.keyword = tag_keyword
         return wrapper
     return decorator
         
         
-def set_node(evaluate, set_name, context):
-    """A node that sets a parameter in the context."""
-    set_name(context, evaluate(context))
-        
-
-@regex_macro("^set\s+(.+?)\s+as\s+(.+?)$")
+@regex_macro("^set\s+(.+?)\s+as\s+(.+)$")
 def set_macro(parser, expression, name):
     """Macro that allows setting of a value in the context."""
-    return partial(set_node, expression_evaluator(expression), name_setter(name))
+    evaluate = expression_evaluator(expression)
+    set_name = name_setter(name)
+    def set_node(context):
+        """A node that sets a parameter in the context."""
+        set_name(context, evaluate(context))
+    return set_node
 
 
-def print_node(evaluate, context):
-    """A node that renders an expression without autoescaping."""
-    context.buffer.append(str(evaluate(context)))
-        
-        
-@regex_macro("^print\s+(.+?)$")
+@regex_macro("^print\s+(.+)$")
 def print_macro(parser, expression):
     """Macro that allows an expression to be rendered without autoescaping."""
-    return partial(print_node, expression_evaluator(expression))
+    evaluate = expression_evaluator(expression)
+    def print_node(context):
+        """A node that renders an expression without autoescaping."""
+        context.buffer.append(str(evaluate(context)))
+    return print_node
 
 
-def import_node(statement, context):
-    """A node that executes the given import expression."""
-    exec(statement, context.meta, context.params)
-        
-        
-@regex_macro("(^from\s+.+?\s+import\s+.+?$|^import\s+.+?$)")
+def import_loader(statement):
+    """
+    Returns a function that performs the given import statement, or None if
+    the statement cannot be resolved ahead of time.
+    
+    The returned function has a signature of load(), and returns a list of
+    (name, value) pairs to assign into the template params.
+    """
+    module = ast.parse(statement)
+    if len(module.body) != 1:
+        return None
+    node, = module.body
+    # Plain imports bind either the top-level package or the aliased module.
+    if isinstance(node, ast.Import):
+        aliases = [(alias.asname or alias.name.split(".", 1)[0], alias.name, alias.asname) for alias in node.names]
+        def load():
+            bindings = []
+            for name, module_name, asname in aliases:
+                value = import_module(module_name)
+                if not asname:
+                    value = import_module(name)
+                bindings.append((name, value))
+            return bindings
+        return load
+    # Relative and star imports are left to the interpreter.
+    if isinstance(node, ast.ImportFrom) and not node.level and not any(alias.name == "*" for alias in node.names):
+        module_name = node.module
+        aliases = [(alias.asname or alias.name, alias.name) for alias in node.names]
+        def load():
+            module = import_module(module_name)
+            bindings = []
+            for name, attr in aliases:
+                try:
+                    value = getattr(module, attr)
+                except AttributeError:
+                    # The name may be a submodule that has not been imported yet.
+                    try:
+                        value = import_module("{}.{}".format(module_name, attr))
+                    except ImportError:
+                        raise ImportError("cannot import name {!r} from {!r}".format(attr, module_name))
+                bindings.append((name, value))
+            return bindings
+        return load
+    return None
+
+
+@regex_macro("(^from\s+.+?\s+import\s+.+$|^import\s+.+$)")
 def import_macro(parser, statement):
     "Macro that implements an import statment."
-    return partial(import_node, compile(statement, "<string>", "exec"))
-
-
-def if_node(clauses, else_block, context):
-    """A node that implements an 'if' expression."""
-    for evaluate, block in clauses:
-        if evaluate(context):
-            block._render_to_context(context)
-            return
-    if else_block:
-        else_block._render_to_context(context)
-
-
-RE_IF_CLAUSE = re.compile("^(elif) (.+?)$|^(else)$|^(endif)$")
-
-@regex_macro("^if\s+(.+?)$")
+    code = compile(statement, "<string>", "exec")
+    load = import_loader(statement)
+    if load is None:
+        def import_node(context):
+            """A node that executes the given import expression."""
+            exec(code, context.meta, context.params)
+        return import_node
+    # Resolve the import on first render, and just bind the names after that.
+    bindings = None
+    def import_node(context):
+        """A node that binds the names from the given import expression."""
+        nonlocal bindings
+        if bindings is None:
+            bindings = load()
+        context.params.update(bindings)
+    return import_node
+
+
+RE_IF_CLAUSE = re.compile("^elif (.+)$|^(else)$|^(endif)$")
+
+# The group indexes of the clauses in RE_IF_CLAUSE.
+RE_IF_CLAUSE_ELIF = 1
+RE_IF_CLAUSE_ELSE = 2
+
+@regex_macro("^if\s+(.+)$")
 def if_macro(parser, expression):
     """A macro that implements an 'if' expression."""
     clauses = []
@@ -76,43 +136,70 @@ def if_macro(parser, expression):
             else_block = block
         else:
             clauses.append((expression_evaluator(expression), block))
-        elif_flag, elif_expression, else_flag, endif_flag = match.groups()
-        if elif_flag:
+        # The last group to match tells which clause tag was found.
+        clause_index = match.lastindex
+        if clause_index == RE_IF_CLAUSE_ELIF:
             if else_tag:
                 raise SyntaxError("{{% elif %}} tag cannot come after {{% else %}}.")
-            expression = elif_expression
-        elif else_flag:
+            expression = match.group(RE_IF_CLAUSE_ELIF)
+        elif clause_index == RE_IF_CLAUSE_ELSE:
             if else_tag:
                 raise SyntaxError("Only one {{% else %}} tag is allowed per {{% if %}} macro.")
             else_tag = True
-        elif endif_flag:
+        else:
             break
-    return partial(if_node, clauses, else_block)
+    # Bind the block render functions now, rather than looking them up on every render.
+    clauses = tuple((evaluate, block._render_to_context) for evaluate, block in clauses)
+    render_else = else_block._render_to_context if else_block else None
+    # Most if tags have a single clause, which needs no loop.
+    if len(clauses) == 1:
+        (evaluate, render_block), = clauses
+        def if_node(context):
+            """A node that implements an 'if' expression."""
+            if evaluate(context):
+                render_block(context)
+            elif render_else:
+                render_else(context)
+        return if_node
+    def if_node(context):
+        """A node that implements an 'if' expression."""
+        for evaluate, render_block in clauses:
+            if evaluate(context):
+                render_block(context)
+                return
+        if render_else:
+            render_else(context)
+    return if_node
     
     
-def for_node(set_name, evaluate, block, context):
-    """A node that implements a 'for' loop."""
-    items = evaluate(context)
-    for item in items:
-        set_name(context, item)
-        block._render_to_context(context)
-
-
 RE_ENDFOR = re.compile("^endfor$")
 
-@regex_macro("^for\s+(.+?)\s+in\s+(.+?)$")
+@regex_macro("^for\s+(.+?)\s+in\s+(.+)$")
 def for_macro(parser, name, expression):
     """A macro that implements a 'for' loop."""
     match, block = parser.parse_block("for", "endfor", RE_ENDFOR)
-    return partial(for_node, name_setter(name), expression_evaluator(expression), block)
-
-
-def py_node(code, context):
-    """A node that allows arbitrary python to be executed."""
-    exec(code, context.meta, context.params)
-
-
-@regex_macro("^py\s(.+?)$")
+    evaluate = expression_evaluator(expression)
+    render_block = block._render_to_context
+    # Loops over a single name assign straight into the params, without calling a setter per item.
+    if "," not in name:
+        name = parse_name(name)
+        def for_node(context):
+            """A node that implements a 'for' loop."""
+            params = context.params
+            for item in evaluate(context):
+                params[name] = item
+                render_block(context)
+        return for_node
+    set_name = name_setter(name)
+    def for_node(context):
+        """A node that implements a 'for' loop."""
+        for item in evaluate(context):
+            set_name(context, item)
+            render_block(context)
+    return for_node
+
+
+@regex_macro("^py\s(.+)$")
 def py_macro(parser, code):
     """Macro that allows arbitrary python to be executed."""
     # Fix indentation in the code.
@@ -128,7 +215,11 @@ def py_macro(parser, code):
     for raw_line in raw_lines:
         code_lines.append(raw_line[indent:])
     # Compile the node renderer.
-    return partial(py_node, compile("\n".join(code_lines), "<string>", "exec"))
+    code = compile("\n".join(code_lines), "<string>", "exec")
+    def py_node(context):
+        """A node that allows arbitrary python to be executed."""
+        exec(code, context.meta, context.params)
+    return py_node
     
     
 def get_template(context, template):
@@ -137,69 +228,66 @@ def get_template(context, template):
 
     Otherwise, if template is a template, returns the template.
     """
-    if isinstance(template, Template):
-        return template
     if isinstance(template, str):
         loader = context.meta.get("__loader__")
         if not loader:
             raise ValueError("Cannot load {!r} by name, as this template was not compiled using a template loader.".format(template))
         return loader.load(template)
+    if isinstance(template, Template):
+        return template
     raise TypeError("Expected a Template or a str, found {!r}.".format(template))
 
 
-def include_node(evaluate, context):
-    """A node that implements an 'include' expression."""
-    template = get_template(context, evaluate(context))
-    template._render_to_sub_context(context, {})
-
-
-@regex_macro("^include\s+(.+?)$")
+@regex_macro("^include\s+(.+)$")
 def include_macro(parser, expression):
     """Macro that implements an 'include' expression."""
-    return partial(include_node, expression_evaluator(expression))
-
-
-def block_node(name, block, context):
-    """A block of inheritable content."""
-    # Get the block stack.
-    block_stack = [(context, block)]
-    child_context = context
-    while "__child__" in child_context.meta:
-        child_context = child_context.meta["__child__"]
-        block = child_context.meta["__blocks__"].get(name)
-        if block:
-            block_context = child_context
-            block_stack.append((block_context, block))
-    # Render the topmost block.
-    block_context, block = block_stack.pop()
-    sub_context = block_context.sub_context(meta={"__parent_blocks__": block_stack})
-    block._render_to_context(sub_context)
+    evaluate = expression_evaluator(expression)
+    def include_node(context):
+        """A node that implements an 'include' expression."""
+        template = get_template(context, evaluate(context))
+        template._render_to_sub_context(context, {})
+    return include_node
+
+
+@lru_cache(maxsize=256)
+def endblock_regex(name):
+    """Returns a regex that matches the end of the named block."""
+    return re.compile("^endblock$|^endblock\s+{}$".format(re.escape(name)))
 
 
 @regex_macro("^block\s+([a-zA-Z_][a-zA-Z_\-0-9]*)$")
 def block_macro(parser, name):
     """Macro that implements an inheritable template block."""
-    match, block = parser.parse_block("block", "endblock", re.compile("^endblock$|^endblock\s+{}$".format(name)))
+    match, block = parser.parse_block("block", "endblock", endblock_regex(name))
     # Register with the parser.
-    block_meta = parser.meta.get("__blocks__") or parser.meta.setdefault("__blocks__", {})
+    block_meta = parser.meta.get("__blocks__")
+    if block_meta is None:
+        block_meta = parser.meta["__blocks__"] = {}
     if name in block_meta:
         raise SyntaxError("Multiple blocks named {!r} are not allowed in a child template.".format(name))
     block_meta[name] = block
     # Return the node.
-    return partial(block_node, name, block)
+    def block_node(context):
+        """A block of inheritable content."""
+        # Get the block stack, with the overrides from any child templates on top.
+        block_stack = [(context, block)]
+        child_block_stacks = context.meta.get("__block_stacks__")
+        if child_block_stacks:
+            block_stack.extend(child_block_stacks.get(name, ()))
+        # Render the topmost block.
+        block_context, top_block = block_stack.pop()
+        sub_context = block_context.sub_context(meta={"__parent_blocks__": block_stack})
+        top_block._render_to_context(sub_context)
+    return block_node
 
 
 def super_node(context):
-    """A node that renders the parent block's content."""    
-    if "__parent_blocks__" in context.meta:
-        block_stack = context.meta["__parent_blocks__"][:]
-        try:
-            block_context, block = block_stack.pop()
-        except IndexError:
-            pass
-        else:
-            sub_context = block_context.sub_context(meta={"__parent_blocks__": block_stack})
-            block._render_to_context(sub_context)
+    """A node that renders the parent block's content."""
+    block_stack = context.meta.get("__parent_blocks__")
+    if block_stack:
+        block_context, block = block_stack[-1]
+        sub_context = block_context.sub_context(meta={"__parent_blocks__": block_stack[:-1]})
+        block._render_to_context(sub_context)
     
     
 @regex_macro("^super$")
@@ -208,23 +296,30 @@ def super_macro(parser):
     return super_node
 
 
-def extends_node(evaluate, block_nodes, context):
-    """Implements a inherited child template."""
-    # Create a summary of my blocks.
-    context.meta["__blocks__"] =  block_nodes
-    # Render the parent template with my blocks.
-    template = get_template(context, evaluate(context))
-    template._render_to_sub_context(context, {"__child__": context})
-
-
-@regex_macro("^extends\s+(.+?)$")
+@regex_macro("^extends\s+(.+)$")
 def extends_macro(parser, expression):
     """Macro that implements an inherited child template."""
     # Parse the rest of the template.
     nodes = parser.parse_all_nodes()
     # Go through the nodes, looking for all block tags.
-    block_nodes = parser.meta.get("__blocks__") or parser.meta.setdefault("__blocks__", {})
-    return partial(extends_node, expression_evaluator(expression), block_nodes)
+    block_nodes = parser.meta.get("__blocks__")
+    if block_nodes is None:
+        block_nodes = parser.meta["__blocks__"] = {}
+    evaluate = expression_evaluator(expression)
+    def extends_node(context):
+        """Implements a inherited child template."""
+        # Stack my blocks under the overrides from any child templates, so block tags need a single lookup.
+        child_block_stacks = context.meta.get("__block_stacks__")
+        if child_block_stacks:
+            block_stacks = child_block_stacks.copy()
+            for block_name, block in block_nodes.items():
+                block_stacks[block_name] = ((context, block),) + child_block_stacks.get(block_name, ())
+        else:
+            block_stacks = dict((block_name, ((context, block),)) for block_name, block in block_nodes.items())
+        # Render the parent template with my blocks.
+        template = get_template(context, evaluate(context))
+        template._render_to_sub_context(context, {"__block_stacks__": block_stacks})
+    return extends_node
 
 
 # The set of default macros.
@@ -1,29 +1,14 @@
 """The main template parser."""
 
-import os, re
-from functools import partial
+import os, re, sys
+from functools import lru_cache
+from html import escape as escape_html
 
 from moody.errors import TemplateCompileError
-from moody.base import expression_evaluator, Template, TemplateFragment
+from moody.base import expression_evaluator, ExpressionNode, Template, TemplateFragment
 from moody.macros import DEFAULT_MACROS
         
         
-def string_node(value, context):
-    """A node containing a static string value."""
-    context.buffer.append(value)
-
-
-def expression_node(evaluate, context):
-    """A node that evaluates and prints the given expression."""
-    value = str(evaluate(context))
-    # Apply autoescaping.
-    autoescape = context.meta.get("__autoescape__")
-    if autoescape:
-        value = autoescape(value)
-    # Write the value.
-    context.buffer.append(value)
-
-
 RE_TOKEN = re.compile(r"{#.+?#}|{{\s*(.*?)\s*}}|{%\s*(.*?)\s*%}|\n[ \t]*%%[ \t]*([^\n]+)[ \t]*|\n[ \t]*##[ \t]*[^\n]+[ \t]*", re.DOTALL)
 
 
@@ -55,17 +40,38 @@ def tokenize(template):
     yield lineno, "STRING", template[index:]
 
 
+# The longest static string that will be interned.
+MAX_INTERNED_STRING = 256
+
+
+def build_macro_table(macros):
+    """
+    Groups the given macros by the keyword that starts their tags.
+    
+    Returns a dict mapping each keyword to the macros that could match a tag
+    starting with that keyword, in their original order. Macros without a known
+    keyword are included under every keyword, and under the None key.
+    """
+    keywords = set(getattr(macro, "keyword", None) for macro in macros)
+    return dict(
+        (keyword, tuple(macro for macro in macros if getattr(macro, "keyword", None) in (None, keyword)))
+        for keyword in keywords | set((None,))
+    )
+
+
 class ParserRun:
     
     """The state held by a parser during a run."""
     
-    __slots__ = ("tokens", "name", "macros", "meta",)
+    __slots__ = ("tokens", "name", "macros", "macro_table", "autoescape", "meta",)
     
-    def __init__(self, template, name, macros):
+    def __init__(self, template, name, macros, macro_table=None, autoescape=None):
         """Initializes the ParserRun."""
         self.tokens = tokenize(template)
         self.name = name
         self.macros = macros
+        self.macro_table = macro_table if macro_table is not None else build_macro_table(macros)
+        self.autoescape = autoescape
         self.meta = {}
     
     def parse_template_chunk(self, end_chunk_handler):
@@ -82,13 +88,24 @@ class ParserRun:
         for lineno, token_type, token_contents in self.tokens:
             try:
                 if token_type == "STRING":
-                    node = partial(string_node, token_contents)
+                    if not token_contents:
+                        continue
+                    # Comments split static text in two, so join it back up to save a buffer append.
+                    if nodes and isinstance(nodes[-1][1], str):
+                        lineno, previous_contents = nodes.pop()
+                        token_contents = previous_contents + token_contents
+                    # Short fragments (whitespace, markup) repeat a lot between templates, so share them.
+                    if len(token_contents) <= MAX_INTERNED_STRING:
+                        token_contents = sys.intern(token_contents)
+                    node = token_contents
                 elif token_type == "EXPRESSION":
-                    node = partial(expression_node, expression_evaluator(token_contents))
+                    node = ExpressionNode(expression_evaluator(token_contents), self.autoescape)
                 elif token_type == "MACRO":
-                    # Process macros.
+                    # Process macros, only trying the ones that could match the first word of the tag.
                     node = None
-                    for macro in self.macros:
+                    keyword = token_contents.split(None, 1)[0] if token_contents else None
+                    macro_table = self.macro_table
+                    for macro in macro_table.get(keyword) or macro_table[None]:
                         node = macro(self, token_contents)
                         if node:
                             break
@@ -132,20 +149,6 @@ class ParserRun:
         return self.parse_template_chunk(end_chunk_handler)
 
 
-# Ported from python 3.2 html module. In future versions, we'll just use the builtin.
-_escape_map = {
-    ord("&"): "&amp;",
-    ord("<"): "&lt;",
-    ord(">"): "&gt;",
-    ord('"'): "&quot;",
-    ord("'"): "&#x27;",
-}
-
-def escape_html(value):
-    """Replaces all HTML special characters with the appropriate entities."""
-    return value.translate(_escape_map)
-
-
 # Default rules for autoescaping templates based on name.
 DEFAULT_AUTOESCAPE_FUNCS = {
     ".xml": escape_html,
@@ -159,15 +162,27 @@ class Parser:
     
     """A template parser."""
     
-    __slots__ = ("_macros", "_autoescape_funcs",)
+    __slots__ = ("_macros", "_macro_table", "_autoescape_funcs", "_compile_cached",)
     
-    def __init__(self, macros, autoescape_funcs=DEFAULT_AUTOESCAPE_FUNCS):
-        """Initializes the Parser."""
+    def __init__(self, macros, autoescape_funcs=DEFAULT_AUTOESCAPE_FUNCS, cache_size=1024):
+        """
+        Initializes the Parser.
+        
+        Templates compiled without any params or meta are cached by their source
+        and name. The cache holds at most cache_size templates, discarding the
+        least recently used first.
+        """
         self._macros = macros
+        self._macro_table = build_macro_table(macros)
         self._autoescape_funcs = autoescape_funcs
+        self._compile_cached = lru_cache(maxsize=cache_size)(self._compile)
         
-    def compile(self, template, name="__string__", params=None, meta=None):
-        """Compiles the template."""
+    def clear_cache(self):
+        """Clears the compiled template cache."""
+        self._compile_cached.cache_clear()
+        
+    def _compile(self, template, name, params=None, meta=None):
+        """Compiles the template, bypassing the cache."""
         # Get the autoescape function.
         _, extension = os.path.splitext(name)
         autoescape = self._autoescape_funcs.get(extension)
@@ -179,10 +194,17 @@ class Parser:
         default_meta.update(meta or {})
         # Get the default params.
         params = params or {}
-        # Render the main block.
-        nodes = ParserRun(template, name, self._macros).parse_all_nodes()
+        # Render the main block, escaping expressions with the final autoescape function.
+        nodes = ParserRun(template, name, self._macros, self._macro_table, default_meta["__autoescape__"]).parse_all_nodes()
         return Template(nodes, name, params, default_meta)
         
+    def compile(self, template, name="__string__", params=None, meta=None):
+        """Compiles the template."""
+        # Compiled templates are immutable, so ones that only depend on the source can be shared.
+        if not params and not meta:
+            return self._compile_cached(template, name)
+        return self._compile(template, name, params, meta)
+        
         
 # The default parser, using the default set of macros.
 default_parser = Parser(DEFAULT_MACROS)
\ No newline at end of file
@@ -1,4 +1,5 @@
-import unittest, sys
+import unittest, sys, os, tempfile, builtins
+from collections import OrderedDict
 
 import moody
 from moody.errors import TemplateRenderError, TemplateCompileError
@@ -13,11 +14,28 @@ class TestRender(unittest.TestCase):
         
     def testStringTag(self):
         self.assertEqual(moody.render("Hello world"), "Hello world")
+        self.assertEqual(moody.render("Hello {# to the #}world", test="Foo"), "Hello world")
         
     def testExpressionTag(self):
         self.assertEqual(moody.render("{{'Hello world'}}"), "Hello world")
         self.assertEqual(moody.render("{{('Hello '\n'world')}}"), "Hello world")
+        self.assertEqual(moody.render("{{test}}", test="Hello world"), "Hello world")
+        self.assertEqual(moody.render("{{__name__}}{{len}}{{None}}"), "__string__{}None".format(len))
+        self.assertEqual(moody.render("{{test.real}}{{__name__.__class__.__name__}}", test=1), "1str")
+        self.assertRaises(TemplateRenderError, lambda: moody.render("{{test.missing}}", test=1))
     
+    def testBuiltins(self):
+        # Render functions are generated code, so must be able to see the builtins on every interpreter.
+        template1 = moody.compile("{{str(test)}}{% if isinstance(test, int) %}{{len([test])}}{% endif %}")
+        self.assertTrue(template1._render_to_context.__globals__["__builtins__"] is builtins)
+        self.assertEqual(template1.render(test=1), "11")
+        
+    def testUnevaluatedExpression(self):
+        # Expressions that would fail are only a problem if they are actually rendered.
+        template1 = moody.compile("{% if False %}{{ {[]: 1} }}{% endif %}x")
+        self.assertEqual(template1.render(), "x")
+        self.assertRaises(TemplateRenderError, lambda: moody.render("{{ {[]: 1} }}"))
+        
     def testSetMacro(self):
         self.assertEqual(moody.render("{% set 'foo' as test %}{{test}}"), "foo")
         self.assertEqual(moody.render("{% set 'foo', 'bar', as test1, test2 %}{{test1}}{{test2}}"), "foobar")
@@ -28,6 +46,10 @@ class TestRender(unittest.TestCase):
     def testImportMacro(self):
         self.assertEqual(moody.render("{% from operator import add %}{{add(1,1)}}"), "2")
         self.assertEqual(moody.render("{% import operator %}{{operator.add(1,1)}}"), "2")
+        self.assertEqual(moody.render("{% from operator import add as plus, sub %}{{plus(1,1)}}{{sub(1,1)}}"), "20")
+        self.assertEqual(moody.render("{% import os.path %}{{os is os_module}}", os_module=os), "True")
+        self.assertEqual(moody.render("{% import os.path as p %}{{p is os_path}}", os_path=os.path), "True")
+        self.assertRaises(TemplateRenderError, lambda: moody.render("{% from operator import does_not_exist %}"))
         
     def testIfMacro(self):
         # Test single if.
@@ -60,6 +82,7 @@ class TestRender(unittest.TestCase):
         self.assertEqual(template1.render(), "012")
         # Test various syntax errors.
         self.assertRaises(TemplateCompileError, lambda: moody.compile("{% for n in range(0, 3) %}"))
+        self.assertRaises(TemplateCompileError, lambda: moody.compile("{% for 1n in range(0, 3) %}{% endfor %}"))
         # Test variable expansion.
         template2 = moody.compile("{% for n, m in value %}{{n}}{{m}}{% endfor %}")
         self.assertEqual(template2.render(value=[["foo", "bar"]]), "foobar")
@@ -136,11 +159,19 @@ class TestRender(unittest.TestCase):
     def testAutoescape(self):
         template1 = moody.compile("{{value}}{% print value %}", name="test.html")
         self.assertEqual(template1.render(value="<foo bar='bar' baz=\"baz\">"), "&lt;foo bar=&#x27;bar&#x27; baz=&quot;baz&quot;&gt;<foo bar='bar' baz=\"baz\">")
+        template2 = moody.compile("{{value}}{% print value %}", meta={"__autoescape__": str.upper})
+        self.assertEqual(template2.render(value="foo"), "FOOfoo")
         
     def testDefaultParams(self):
         template1 = moody.compile("{{test}}", params={"test": "foo"})
         self.assertEqual(template1.render(), "foo")
         self.assertEqual(template1.render(test="bar"), "bar")
+        
+    def testCompileCache(self):
+        template1 = moody.compile("{{test}}")
+        self.assertTrue(moody.compile("{{test}}") is template1)
+        self.assertFalse(moody.compile("{{test}}", name="test.html") is template1)
+        self.assertFalse(moody.compile("{{test}}", params={"test": "foo"}) is template1)
 
 
 test_loader = moody.make_loader(
@@ -170,9 +201,6 @@ test_loader = moody.make_loader(
 
 class TestLoader(unittest.TestCase):
     
-    def setUp(self):
-        test_loader.clear_cache()
-    
     def testLoad(self):
         self.assertTrue(test_loader.load("simple.txt"))
         
@@ -183,6 +211,12 @@ class TestLoader(unittest.TestCase):
     def testNameStacking(self):
         self.assertEqual(test_loader.render("missing.txt", "simple.txt", test="foo"), "foo")
         
+    def testTemplateNameSubclass(self):
+        class TemplateName(str):
+            pass
+        self.assertEqual(test_loader.render(TemplateName("simple.txt"), test="foo"), "foo")
+        self.assertEqual(test_loader.compile("{% include name %}").render(name=TemplateName("simple.txt"), test="foo"), "foo")
+        
     def testTemplateDoesNotExist(self):
         self.assertRaises(TemplateDoesNotExist, lambda: test_loader.load("missing.txt"))
         
@@ -195,11 +229,54 @@ class TestLoader(unittest.TestCase):
         self.assertEqual(test_loader.render("grandchild.txt"), "Hello Dave Foo")
         
     def testCache(self):
+        test_loader.clear_cache()
         self.assertEqual(len(test_loader._cache), 0)
         test_loader.load("simple.txt")
         self.assertEqual(len(test_loader._cache), 1)
         test_loader.load("simple.txt")
         self.assertEqual(len(test_loader._cache), 1)
+        
+    def testCompileCache(self):
+        template = test_loader.load("grandchild.txt")
+        test_loader.clear_cache(keep_compiled=True)
+        self.assertTrue(test_loader.load("grandchild.txt") is template)
+        test_loader.clear_cache()
+        self.assertFalse(test_loader.load("grandchild.txt") is template)
+        
+    def testCompileSourceOverride(self):
+        # The compiled template cache still goes through any override of _compile_source.
+        compiled = []
+        class RecordingLoader(moody.Loader):
+            def _compile_source(self, template_src, template_name, super_template):
+                compiled.append(template_name)
+                return super(RecordingLoader, self)._compile_source(template_src, template_name, super_template)
+        loader = moody.make_loader(MemorySource({"simple.txt": "{{test}}"}), loader_cls=RecordingLoader)
+        self.assertEqual(loader.render("simple.txt", test="foo"), "foo")
+        self.assertEqual(compiled, ["simple.txt"])
+        
+    def testCacheMissing(self):
+        self.assertRaises(TemplateDoesNotExist, lambda: test_loader.load("missing.txt"))
+        self.assertEqual(test_loader._cache["missing.txt"], [])
+        self.assertEqual(test_loader.render("missing.txt", "simple.txt", test="foo"), "foo")
+        
+    def testCacheSize(self):
+        loader = moody.make_loader(MemorySource({"foo.txt": "Foo", "bar.txt": "Bar", "baz.txt": "Baz"}), cache_size=2)
+        loader.load("foo.txt")
+        loader.load("bar.txt")
+        loader.load("foo.txt")
+        loader.load("baz.txt")
+        self.assertEqual(list(loader._cache), ["foo.txt", "baz.txt"])
+    
+    def testCacheEviction(self):
+        # Simulate another thread evicting a template between the cache read and the LRU update.
+        class EvictingCache(OrderedDict):
+            def move_to_end(self, key, last=True):
+                del self[key]
+                super(EvictingCache, self).move_to_end(key, last)
+        loader = moody.make_loader(MemorySource({"foo.txt": "Foo"}))
+        loader._cache = EvictingCache()
+        loader.load("foo.txt")
+        self.assertEqual(loader.render("foo.txt"), "Foo")
     
     def testOverride(self):
         self.assertEqual(test_loader.render("override.txt"), "Bar")
@@ -217,6 +294,14 @@ class TestLoader(unittest.TestCase):
         self.assertEqual(test_loader.render("super_block_child.txt"), "Dave Hall")
         self.assertEqual(test_loader.render("super_block_grandchild.txt"), "Dave Hall the great")
         
+    def testCompileOverride(self):
+        # Templates loaded by name go through the public compile method, so subclasses can hook it.
+        class ParamsLoader(moody.Loader):
+            def compile(self, template, name="__string__", params=None, meta=None):
+                return super(ParamsLoader, self).compile(template, name, {"test": "foo"}, meta)
+        loader = moody.make_loader(MemorySource({"simple.txt": "{{test}}"}), loader_cls=ParamsLoader)
+        self.assertEqual(loader.render("simple.txt"), "foo")
+        
     def testStandaloneCompile(self):
         self.assertEqual(test_loader.compile("{% include 'simple.txt' %}").render(test="foo"), "foo")
 
@@ -227,6 +312,28 @@ class TestDirectorySource(unittest.TestCase):
         loader = moody.make_loader(*sys.path)
         with open(moody.__file__, "r") as expected:
             self.assertEqual(loader.render("moody/__init__.py"), expected.read())
+            
+    def testSkippedDirs(self):
+        loader = moody.make_loader(os.path.dirname(moody.__file__), moody.__file__, os.path.dirname(moody.__file__) + "/")
+        self.assertEqual(len(loader._sources), 1)
+            
+    def testByteOrderMark(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            with open(os.path.join(dirname, "bom.txt"), "w", encoding="utf-8-sig") as template_file:
+                template_file.write("Hello w\u00f6rld")
+            self.assertEqual(moody.make_loader(dirname).render("bom.txt"), "Hello w\u00f6rld")
+            
+    def testNewlines(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            with open(os.path.join(dirname, "newlines.txt"), "wb") as template_file:
+                template_file.write(b"Hello\r\nworld\r")
+            self.assertEqual(moody.make_loader(dirname).render("newlines.txt"), "Hello\nworld\n")
+            
+    def testUnopenableName(self):
+        with tempfile.TemporaryDirectory() as dirname:
+            loader = moody.make_loader(MemorySource({"simple.txt": "{{test}}"}), dirname)
+            self.assertRaises(TemplateDoesNotExist, lambda: loader.load("a" * 5000))
+            self.assertEqual(loader.render("a" * 5000, "simple.txt", test="foo"), "foo")
 
 
 class TestErrorReporting(unittest.TestCase):